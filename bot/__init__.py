@@ -1,13 +1,19 @@
+import collections
 import re
+import traceback
 from os import environ
 
 import aiohttp
 import asyncpg
 import cachetools
 import discord
+from discord import gateway
 from discord.ext import commands
 
 from bot import cmd
+from bot.config import GuildConfigStore
+from bot.jobs import JobManager
+from bot.memberedits import MemberEditQueue
 from bot.utils import wrap_in_code
 
 initial_extensions = (
@@ -19,11 +25,12 @@ initial_extensions = (
     "bot.ext.voice",
     "bot.ext.emoji",
     "bot.ext.chat",
+    "bot.ext.jobs",
 )
 
 
 class Bot(commands.AutoShardedBot):
-    def __init__(self):
+    def __init__(self, **options):
         super().__init__(
             command_prefix=self.get_prefix_list,
             description="General purpose utility do it all bot",
@@ -45,8 +52,17 @@ class Bot(commands.AutoShardedBot):
             ),
             member_cache_flags=discord.MemberCacheFlags.none(),
             max_messages=None,
+            **options,
         )
 
+        self.raw_listeners = collections.defaultdict(list)
+        self.raw_event_counts = collections.Counter()
+        self.guild_configs = GuildConfigStore(self)
+        self.jobs = JobManager(self)
+        self.member_edits = MemberEditQueue(self)
+        self.message_matchers = {}
+        self.message_contexts = cachetools.LRUCache(maxsize=256)
+
         self.add_check(self.global_check)
 
         for extension in initial_extensions:
@@ -55,31 +71,48 @@ class Bot(commands.AutoShardedBot):
     async def start(self, *args, **kwargs):
         self.session = aiohttp.ClientSession()
         self.pool = await asyncpg.create_pool(dsn=environ.get("DATABASE_DSN"))
+        self.guild_configs_listener = self.loop.create_task(self.guild_configs.listen())
         await super().start(*args, **kwargs)
 
     async def close(self):
+        self.guild_configs_listener.cancel()
+        await self.jobs.stop()
+        for cog in tuple(self.cogs.values()):
+            if isinstance(cog, cmd.Cog):
+                # A failing cog must not keep the rest of the bot from closing
+                try:
+                    await cog.cog_close()
+                except Exception:
+                    traceback.print_exc()
         await self.session.close()
         await self.pool.close()
         await super().close()
 
-    prefix_cache = cachetools.TTLCache(maxsize=float("inf"), ttl=900)
+    def add_raw_listener(self, func, event_type):
+        self.raw_listeners[event_type].append(func)
+
+    def remove_raw_listener(self, func, event_type):
+        try:
+            self.raw_listeners[event_type].remove(func)
+        except ValueError:
+            pass
+
+    async def on_socket_response(self, event):
+        if event["op"] != gateway.DiscordWebSocket.DISPATCH:
+            return
+
+        event_type = event["t"]
+        self.raw_event_counts[event_type] += 1
+
+        for listener in self.raw_listeners.get(event_type, ()):
+            self._schedule_event(listener, f"raw {event_type}", event["d"])
 
     async def get_prefix_for_message(self, message):
         if not message.guild:
             return ";"
 
-        try:
-            return self.prefix_cache[message.guild.id]
-        except KeyError:
-            prefix = await self.pool.fetchval(
-                """
-                SELECT prefix FROM guild_config
-                WHERE guild_id = $1
-                """,
-                message.guild.id,
-            )
-            self.prefix_cache[message.guild.id] = prefix or ";"
-            return await self.get_prefix_for_message(message)
+        config = await self.guild_configs.get(message.guild.id)
+        return config.prefix or ";"
 
     async def get_prefix_list(self, bot, message):
         prefix = await self.get_prefix_for_message(message)
@@ -91,6 +124,43 @@ class Bot(commands.AutoShardedBot):
             prefix,
         )
 
+    def get_message_matcher(self, prefix):
+        try:
+            return self.message_matchers[prefix]
+        except KeyError:
+            self.message_matchers[prefix] = re.compile(
+                rf"(?P<command>{re.escape(prefix)}|<@!?{self.user.id}>)?"
+                r"(?:.*?(?P<link>discord(?:app)?\.com/channels/))?",
+                re.DOTALL,
+            )
+
+            return self.message_matchers[prefix]
+
+    async def match_message(self, message):
+        """Matches a command prefix and message links in a single pass.
+
+        The ``command`` group is set if the message starts with a prefix or a
+        mention, the ``link`` group if it contains a message link.
+        """
+
+        prefix = await self.get_prefix_for_message(message)
+
+        return self.get_message_matcher(prefix).match(message.content)
+
+    async def get_message_context(self, message):
+        """Gets the context for a message, parsing it only once.
+
+        Listeners handling the same message share the same context object.
+        """
+
+        try:
+            return self.message_contexts[message.id]
+        except KeyError:
+            ctx = await self.get_context(message, cls=cmd.Context)
+            self.message_contexts[message.id] = ctx
+
+            return ctx
+
     async def global_check(self, ctx):
         await commands.bot_has_permissions(
             send_messages=True,
@@ -103,22 +173,34 @@ class Bot(commands.AutoShardedBot):
     async def on_ready(self):
         print(f"Ready as {self.user} ({self.user.id})")
 
+    async def on_shard_ready(self, shard_id):
+        guild_ids = [guild.id for guild in self.guilds if guild.shard_id == shard_id]
+
+        await self.guild_configs.load(guild_ids)
+        await self.jobs.resume(guild_ids)
+
+    async def on_guild_join(self, guild):
+        await self.guild_configs.load([guild.id])
+
+    async def on_guild_available(self, guild):
+        # Guilds becoming available during startup are loaded by on_shard_ready
+        if self.is_ready() and guild.id not in self.guild_configs:
+            await self.guild_configs.load([guild.id])
+
+    async def on_guild_remove(self, guild):
+        self.guild_configs.evict(guild.id)
+
     async def on_message(self, message):
         if message.author.bot:
             return
 
-        if message.guild and message.guild.id not in self.prefix_cache:
-            await self.pool.execute(
-                """
-                INSERT INTO guild_config (guild_id) VALUES ($1)
-                ON CONFLICT DO NOTHING
-                """,
-                message.guild.id,
-            )
+        match = await self.match_message(message)
+        if not match["command"]:
+            return
 
-        ctx = await self.get_context(message, cls=cmd.Context)
+        ctx = await self.get_message_context(message)
 
-        if re.fullmatch(rf"<@!?{self.user.id}>", message.content):
+        if message.content in (f"<@{self.user.id}>", f"<@!{self.user.id}>"):
             prefix = await self.get_prefix_for_message(message)
 
             await message.channel.send(
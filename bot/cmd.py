@@ -1,12 +1,73 @@
+import inspect
+
+from bot.config import GuildConfig
 from discord.ext import commands
 
 
+def raw_listener(*event_types):
+    """Marks a cog method as a handler for raw gateway dispatches.
+
+    The method receives the ``d`` payload of every dispatch whose type is one
+    of ``event_types``, routed by :meth:`bot.Bot.on_socket_response`.
+    """
+
+    def decorator(func):
+        func.__raw_listener_events__ = event_types
+        return func
+
+    return decorator
+
+
+def config_flag(column: str):
+    """A check that a boolean column of the guild config is enabled.
+
+    The flag is read from :class:`bot.config.GuildConfigStore`, which is kept
+    up to date by config updates and database notifications, so evaluating
+    the check does not query the database.
+    """
+
+    if column not in GuildConfig.columns:
+        raise ValueError(f"Unknown guild_config column {column!r}")
+
+    async def predicate(ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+
+        config = ctx.bot.guild_configs.cache.get(ctx.guild.id)
+        if config is None:
+            config = await ctx.bot.guild_configs.get(ctx.guild.id)
+
+        if not getattr(config, column):
+            raise commands.DisabledCommand()
+
+        return True
+
+    return commands.check(predicate)
+
+
 class Cog(commands.Cog):
     def __init__(self, bot):
         super().__init__()
 
         self.bot = bot
 
+        for event_type, listener in self.get_raw_listeners():
+            bot.add_raw_listener(listener, event_type)
+
+    def get_raw_listeners(self):
+        for _, method in inspect.getmembers(self, inspect.ismethod):
+            for event_type in getattr(method, "__raw_listener_events__", ()):
+                yield event_type, method
+
+    def cog_unload(self):
+        for event_type, listener in self.get_raw_listeners():
+            self.bot.remove_raw_listener(listener, event_type)
+
+    async def cog_close(self):
+        """Called when the bot is closing, before the database pool is closed."""
+
+        pass
+
 
 class Context(commands.Context):
     pass
@@ -0,0 +1,104 @@
+import bisect
+from array import array
+
+
+class MemberNickMap:
+    """A compact mapping of member IDs to nicks.
+
+    Member IDs are kept sorted in an ``array("Q")`` rather than as boxed ints
+    in a dict. Nicks are stored UTF-8 encoded in a single ``bytearray``, with
+    parallel arrays holding the offset and length of each member's nick.
+
+    Changing or removing a nick leaves its old bytes behind, the buffer is
+    compacted once more than half of it is unused.
+    """
+
+    __slots__ = ("member_ids", "offsets", "lengths", "buffer", "garbage")
+
+    def __init__(self, items=()):
+        self.member_ids = array("Q")
+        self.offsets = array("I")
+        self.lengths = array("H")
+        self.buffer = bytearray()
+        self.garbage = 0
+
+        for member_id, nick in sorted(items):
+            self.member_ids.append(member_id)
+            self._append_nick(len(self.offsets), nick)
+
+    def __len__(self):
+        return len(self.member_ids)
+
+    def _find(self, member_id: int):
+        index = bisect.bisect_left(self.member_ids, member_id)
+        found = index < len(self.member_ids) and self.member_ids[index] == member_id
+
+        return index, found
+
+    def _append_nick(self, index: int, nick: str):
+        encoded = nick.encode()
+
+        self.offsets.insert(index, len(self.buffer))
+        self.lengths.insert(index, len(encoded))
+        self.buffer += encoded
+
+    def _nick(self, index: int):
+        offset = self.offsets[index]
+        return self.buffer[offset : offset + self.lengths[index]].decode()
+
+    def _remove_nick(self, index: int):
+        self.garbage += self.lengths[index]
+
+        del self.offsets[index]
+        del self.lengths[index]
+
+    def _compact(self):
+        buffer = bytearray()
+
+        for index, (offset, length) in enumerate(zip(self.offsets, self.lengths)):
+            self.offsets[index] = len(buffer)
+            buffer += self.buffer[offset : offset + length]
+
+        self.buffer = buffer
+        self.garbage = 0
+
+    def __contains__(self, member_id: int):
+        return self._find(member_id)[1]
+
+    def get(self, member_id: int, default=None):
+        index, found = self._find(member_id)
+
+        return self._nick(index) if found else default
+
+    def __setitem__(self, member_id: int, nick: str):
+        index, found = self._find(member_id)
+
+        if found:
+            # Point the existing entry at the new bytes, without shifting
+            encoded = nick.encode()
+
+            self.garbage += self.lengths[index]
+            self.offsets[index] = len(self.buffer)
+            self.lengths[index] = len(encoded)
+            self.buffer += encoded
+        else:
+            self.member_ids.insert(index, member_id)
+            self._append_nick(index, nick)
+
+        if self.garbage > len(self.buffer) // 2:
+            self._compact()
+
+    def pop(self, member_id: int, default=None):
+        index, found = self._find(member_id)
+        if not found:
+            return default
+
+        nick = self._nick(index)
+
+        del self.member_ids[index]
+        self._remove_nick(index)
+
+        if self.garbage > len(self.buffer) // 2:
+            self._compact()
+
+        return nick
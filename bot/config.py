@@ -0,0 +1,182 @@
+import asyncio
+
+import asyncpg
+
+
+class GuildConfig:
+    """In-memory copy of a row of ``guild_config``.
+
+    Values are read straight from the attributes, changes go through
+    :meth:`update` which writes them to the database first.
+    """
+
+    columns = (
+        "prefix",
+        "selfrole",
+        "selfrole_pronoun",
+        "embed_messages",
+        "auto_clean_dehoist",
+        "auto_clean_normalize",
+        "autorole_id",
+    )
+
+    # Array columns are kept as frozensets for cheap membership checks
+    set_columns = {"selfrole"}
+
+    def __init__(self, pool, record):
+        self.pool = pool
+        self.guild_id = record["guild_id"]
+
+        self.apply(record)
+
+    def __repr__(self):
+        return f"<GuildConfig guild_id={self.guild_id}>"
+
+    def apply(self, record):
+        """Replaces cached values with those of a freshly fetched row."""
+
+        for column in self.columns:
+            self._set(column, record[column])
+
+    def _set(self, column: str, value):
+        if column in self.set_columns:
+            value = frozenset(value)
+
+        setattr(self, column, value)
+
+    async def update(self, **values):
+        for column in values:
+            if column not in self.columns:
+                raise ValueError(f"Unknown guild_config column {column!r}")
+
+        assignments = ", ".join(
+            f"{column} = ${index}" for index, column in enumerate(values, start=2)
+        )
+        await self.pool.execute(
+            f"""
+            UPDATE guild_config
+            SET {assignments}
+            WHERE guild_id = $1
+            """,
+            self.guild_id,
+            *(
+                list(value) if column in self.set_columns else value
+                for column, value in values.items()
+            ),
+        )
+
+        for column, value in values.items():
+            self._set(column, value)
+
+    async def add_selfrole(self, role_id: int):
+        await self._update_selfrole(
+            "array_append(array_remove(selfrole, $2), $2)", role_id
+        )
+
+    async def remove_selfroles(self, role_ids):
+        await self._update_selfrole(
+            "ARRAY(SELECT unnest(selfrole) EXCEPT SELECT unnest($2::BIGINT[]))",
+            list(role_ids),
+        )
+
+    async def _update_selfrole(self, expression: str, value):
+        # Changed in place so concurrent changes are not lost
+        record = await self.pool.fetchrow(
+            f"""
+            UPDATE guild_config
+            SET selfrole = {expression}
+            WHERE guild_id = $1
+            RETURNING selfrole
+            """,
+            self.guild_id,
+            value,
+        )
+
+        self._set("selfrole", record["selfrole"])
+
+
+class GuildConfigStore:
+    """Holds one :class:`GuildConfig` per guild.
+
+    Configs are loaded in bulk with :meth:`load` when a shard becomes ready or
+    a guild is joined, so reading them afterwards never needs a query.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.cache = {}
+
+    def __contains__(self, guild_id: int):
+        return guild_id in self.cache
+
+    async def load(self, guild_ids):
+        """Creates missing rows and loads configs for all ``guild_ids`` at once."""
+
+        guild_ids = list(guild_ids)
+        if not guild_ids:
+            return
+
+        records = await self.bot.pool.fetch(
+            """
+            WITH inserted AS (
+                INSERT INTO guild_config (guild_id)
+                SELECT unnest($1::BIGINT[])
+                ON CONFLICT DO NOTHING
+                RETURNING *
+            )
+            SELECT * FROM inserted
+            UNION ALL
+            SELECT * FROM guild_config
+            WHERE guild_id = ANY($1::BIGINT[])
+            """,
+            guild_ids,
+        )
+
+        for record in records:
+            config = self.cache.get(record["guild_id"])
+            if config:
+                config.apply(record)
+            else:
+                self.cache[record["guild_id"]] = GuildConfig(self.bot.pool, record)
+
+    async def listen(self):
+        """Keeps configs up to date with changes made by other processes.
+
+        Every update to ``guild_config`` sends a notification on the
+        ``guild_config`` channel with the guild ID as payload, cached configs
+        for that guild are then reloaded.
+        """
+
+        while not self.bot.is_closed():
+            terminated = asyncio.Event()
+
+            def on_termination(connection):
+                terminated.set()
+
+            try:
+                async with self.bot.pool.acquire() as connection:
+                    connection.add_termination_listener(on_termination)
+                    await connection.add_listener("guild_config", self.on_notify)
+
+                    # Changes made while nothing was listening were missed
+                    await self.load(list(self.cache))
+
+                    await terminated.wait()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                await asyncio.sleep(5)
+
+    def on_notify(self, connection, pid, channel, payload):
+        guild_id = int(payload)
+        if guild_id in self.cache:
+            self.bot.loop.create_task(self.load([guild_id]))
+
+    def evict(self, guild_id: int):
+        self.cache.pop(guild_id, None)
+
+    async def get(self, guild_id: int) -> GuildConfig:
+        try:
+            return self.cache[guild_id]
+        except KeyError:
+            await self.load([guild_id])
+
+            return self.cache[guild_id]
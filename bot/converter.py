@@ -12,18 +12,23 @@ class MessageConverter(commands.MessageConverter):
     leaking messages from other guilds, or channels the member cannot read.
     """
 
-    async def convert(self, ctx: cmd.Context, argument):
-        message = await super().convert(ctx, argument)
+    @staticmethod
+    def check_readable(ctx: cmd.Context, message: discord.Message):
+        """Raises if ``ctx.author`` cannot read ``message``."""
 
         perms = message.channel.permissions_for(ctx.author)
-        if (
+        if not (
             message.guild == ctx.guild
             and perms.read_messages
             and perms.read_message_history
         ):
-            return message
+            raise commands.ChannelNotReadable(message.channel)
+
+    async def convert(self, ctx: cmd.Context, argument):
+        message = await super().convert(ctx, argument)
+        self.check_readable(ctx, message)
 
-        raise commands.ChannelNotReadable(message.channel)
+        return message
 
 
 class PartialEmojiConverter(commands.PartialEmojiConverter):
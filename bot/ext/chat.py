@@ -1,33 +1,82 @@
+import asyncio
+import collections
+import functools
 import re
+import sys
 import unicodedata
 
 import cachetools
 import discord
-from bot import cmd, converter
-from discord import gateway
+from bot import cmd, converter, jobs
+from bot.compact import MemberNickMap
+from bot.utils import get_command_signature
+from bot.writebehind import WriteBehindBuffer
 from discord.ext import commands
+from discord.http import Route
 from discord.utils import escape_markdown
 
+# Characters removed when normalizing, and stripped from the start when dehoisting
+combining_chars = {
+    codepoint: None
+    for codepoint in range(sys.maxunicode + 1)
+    if unicodedata.combining(chr(codepoint))
+}
+hoisting_chars = "".join(map(chr, range(ord("0"))))
+
+
+@functools.lru_cache(maxsize=4096)
+def clean_display_name(text: str, normalize: bool, dehoist: bool):
+    # ASCII text is already normalized and has no combining characters
+    if normalize and not text.isascii():
+        text = unicodedata.normalize("NFKC", text).translate(combining_chars)
+
+    if dehoist:
+        text = text.lstrip(hoisting_chars)
+
+    return text
+
 
 class Chat(cmd.Cog):
     """Chat related commands"""
 
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.cleaned_username_writes = WriteBehindBuffer(
+            self.write_cleaned_usernames,
+            on_error=functools.partial(bot.on_error, "cleaned username writes"),
+        )
+        self.embeds_in_flight = 0
+
+        for name, (action, normalize, dehoist) in self.nick_job_types.items():
+            bot.jobs.add_type(
+                name,
+                functools.partial(
+                    self.plan_nick_change, normalize=normalize, dehoist=dehoist
+                ),
+                title="Nickname",
+                action=action,
+                kind="nick",
+            )
+
+    def cog_unload(self):
+        super().cog_unload()
+
+        self.cleaned_username_writes.flush_soon()
+
+        for name in self.nick_job_types:
+            self.bot.jobs.remove_type(name)
+
     @commands.command()
     @commands.cooldown(3, 8, commands.BucketType.guild)
     @commands.has_guild_permissions(manage_messages=True)
     async def embedmessage(self, ctx: cmd.Context, enable: bool = None):
         """Toggles whether or not I should embed message links"""
 
-        if enable is None:
-            enabled = await ctx.bot.pool.fetchval(
-                """
-                SELECT embed_messages FROM guild_config
-                WHERE guild_id = $1
-                """,
-                ctx.guild.id,
-            )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-            enabled_str = "will" if enabled else "will not"
+        if enable is None:
+            enabled_str = "will" if config.embed_messages else "will not"
             await ctx.reply(
                 embed=discord.Embed(
                     title="Embed messages",
@@ -36,15 +85,7 @@ class Chat(cmd.Cog):
             )
             return
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET embed_messages = $1
-            WHERE guild_id = $2
-            """,
-            enable,
-            ctx.guild.id,
-        )
+        await config.update(embed_messages=enable)
 
         enabled_str = "will now" if enable else "will no longer"
         await ctx.reply(
@@ -99,19 +140,7 @@ class Chat(cmd.Cog):
     def clean_display_name(
         self, text: str, *, normalize: bool = True, dehoist: bool = True
     ):
-        if normalize:
-            text = unicodedata.normalize("NFKC", text)
-
-        ret = ""
-
-        for char in text:
-            if dehoist and not ret and ord(char) < ord("0"):
-                continue
-
-            if not normalize or unicodedata.combining(char) == 0:
-                ret += char
-
-        return ret
+        return clean_display_name(text, normalize, dehoist)
 
     @commands.group(invoke_without_command=True)
     @commands.cooldown(3, 8, commands.BucketType.channel)
@@ -120,96 +149,95 @@ class Chat(cmd.Cog):
 
         await ctx.send_help("nick")
 
+    nick_job_types = {
+        "nick_clean": ("Cleaning up nicknames", True, True),
+        "nick_dehoist": ("Dehoisting nicknames", False, True),
+        "nick_normalize": ("Normalizing nicknames", True, False),
+    }
+
+    def plan_nick_change(
+        self, job: jobs.Job, member: discord.Member, *, normalize: bool, dehoist: bool
+    ):
+        guild = member.guild
+        if member.bot or member == guild.owner or member.top_role >= guild.me.top_role:
+            return
+
+        new_nick = self.clean_display_name(
+            member.display_name, normalize=normalize, dehoist=dehoist
+        )
+        if member.display_name != new_nick:
+            route = Route(
+                "PATCH",
+                "/guilds/{guild_id}/members/{user_id}",
+                guild_id=guild.id,
+                user_id=member.id,
+            )
+            job.add(
+                route.bucket,
+                self.bot.http.edit_member,
+                guild.id,
+                member.id,
+                nick=new_nick or "{cleaned}",
+            )
+
+    async def start_nick_job(self, ctx: cmd.Context, name: str):
+        job = await self.bot.jobs.create(name, ctx)
+
+        if job is None:
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Nickname",
+                    description="Nicknames are already being changed in this server."
+                    f"\nUse {get_command_signature(ctx, self.nick_cancel)} to stop it.",
+                )
+            )
+
     @nick.command(name="clean")
-    @commands.max_concurrency(1, commands.BucketType.guild)
     @commands.has_guild_permissions(manage_nicknames=True)
     @commands.bot_has_guild_permissions(manage_nicknames=True)
     async def nick_clean(self, ctx: cmd.Context):
         """Cleans up nicknames for members in the server"""
 
-        nicknames_changed = 0
-
-        async with ctx.typing():
-            async for member in ctx.guild.fetch_members(limit=None):
-                if (
-                    member.bot
-                    or member == ctx.guild.owner
-                    or member.top_role >= ctx.guild.me.top_role
-                ):
-                    continue
-
-                new_nick = self.clean_display_name(member.display_name)
-                if member.display_name != new_nick:
-                    nicknames_changed += 1
-                    await member.edit(nick=new_nick or "{cleaned}")
-
-        plural_nickname = "nickname" if nicknames_changed == 1 else "nicknames"
-        await ctx.reply(
-            embed=discord.Embed(
-                title="Nickname",
-                description=f"Successfully cleaned up {nicknames_changed} {plural_nickname}.",
-            )
-        )
+        await self.start_nick_job(ctx, "nick_clean")
 
     @nick.command(name="dehoist")
-    @commands.max_concurrency(1, commands.BucketType.guild)
     @commands.has_guild_permissions(manage_nicknames=True)
     @commands.bot_has_guild_permissions(manage_nicknames=True)
     async def nick_dehoist(self, ctx: cmd.Context):
         """Dehoists nicknames for members in the server"""
 
-        nicknames_changed = 0
-
-        async with ctx.typing():
-            async for member in ctx.guild.fetch_members(limit=None):
-                if (
-                    member.bot
-                    or member == ctx.guild.owner
-                    or member.top_role >= ctx.guild.me.top_role
-                ):
-                    continue
-
-                new_nick = self.clean_display_name(member.display_name, normalize=False)
-                if member.display_name != new_nick:
-                    nicknames_changed += 1
-                    await member.edit(nick=new_nick or "{cleaned}")
-
-        plural_nickname = "nickname" if nicknames_changed == 1 else "nicknames"
-        await ctx.reply(
-            embed=discord.Embed(
-                title="Nickname",
-                description=f"Successfully dehoisted {nicknames_changed} {plural_nickname}.",
-            )
-        )
+        await self.start_nick_job(ctx, "nick_dehoist")
 
     @nick.command(name="normalize", aliases=["normalise"])
-    @commands.max_concurrency(1, commands.BucketType.guild)
     @commands.has_guild_permissions(manage_nicknames=True)
     @commands.bot_has_guild_permissions(manage_nicknames=True)
     async def nick_normalize(self, ctx: cmd.Context):
         """Normalize nicknames for members in the server"""
 
-        nicknames_changed = 0
+        await self.start_nick_job(ctx, "nick_normalize")
 
-        async with ctx.typing():
-            async for member in ctx.guild.fetch_members(limit=None):
-                if (
-                    member.bot
-                    or member == ctx.guild.owner
-                    or member.top_role >= ctx.guild.me.top_role
-                ):
-                    continue
+    @nick.command(name="cancel")
+    @commands.has_guild_permissions(manage_nicknames=True)
+    async def nick_cancel(self, ctx: cmd.Context):
+        """Stops cleaning, dehoisting or normalizing nicknames"""
+
+        nick_jobs = await self.bot.jobs.fetch_guild_jobs(ctx.guild.id, kind="nick")
+        if not nick_jobs:
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Nickname",
+                    description="Nicknames are not being changed in this server.",
+                )
+            )
+            return
 
-                new_nick = self.clean_display_name(member.display_name, dehoist=False)
-                if member.display_name != new_nick:
-                    nicknames_changed += 1
-                    await member.edit(nick=new_nick or "{cleaned}")
+        for job in nick_jobs:
+            await self.bot.jobs.cancel(ctx.guild.id, job.job_id)
 
-        plural_nickname = "nickname" if nicknames_changed == 1 else "nicknames"
         await ctx.reply(
             embed=discord.Embed(
                 title="Nickname",
-                description=f"Successfully normalized {nicknames_changed} {plural_nickname}.",
+                description="Stopped changing nicknames.",
             )
         )
 
@@ -219,16 +247,10 @@ class Chat(cmd.Cog):
     async def nick_autodehoist(self, ctx: cmd.Context, enable: bool = None):
         """Toggles whether or not I should embed message links"""
 
-        if enable is None:
-            enabled = await ctx.bot.pool.fetchval(
-                """
-                SELECT auto_clean_dehoist FROM guild_config
-                WHERE guild_id = $1
-                """,
-                ctx.guild.id,
-            )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-            enabled_str = "are" if enabled else "are not"
+        if enable is None:
+            enabled_str = "are" if config.auto_clean_dehoist else "are not"
             await ctx.reply(
                 embed=discord.Embed(
                     title="Auto dehoist",
@@ -237,21 +259,7 @@ class Chat(cmd.Cog):
             )
             return
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET auto_clean_dehoist = $1
-            WHERE guild_id = $2
-            """,
-            enable,
-            ctx.guild.id,
-        )
-
-        try:
-            _, normalize = self.auto_clean_cache[ctx.guild.id]
-            self.auto_clean_cache[ctx.guild.id] = enable, normalize
-        except KeyError:
-            pass
+        await config.update(auto_clean_dehoist=enable)
 
         enabled_str = "will now" if enable else "will no longer"
         await ctx.reply(
@@ -267,16 +275,10 @@ class Chat(cmd.Cog):
     async def nick_autonormalize(self, ctx: cmd.Context, enable: bool = None):
         """Toggles whether or not I should embed message links"""
 
-        if enable is None:
-            enabled = await ctx.bot.pool.fetchval(
-                """
-                SELECT auto_clean_normalize FROM guild_config
-                WHERE guild_id = $1
-                """,
-                ctx.guild.id,
-            )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-            enabled_str = "are" if enabled else "are not"
+        if enable is None:
+            enabled_str = "are" if config.auto_clean_normalize else "are not"
             await ctx.reply(
                 embed=discord.Embed(
                     title="Auto normalize",
@@ -285,21 +287,7 @@ class Chat(cmd.Cog):
             )
             return
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET auto_clean_normalize = $1
-            WHERE guild_id = $2
-            """,
-            enable,
-            ctx.guild.id,
-        )
-
-        try:
-            dehoist, _ = self.auto_clean_cache[ctx.guild.id]
-            self.auto_clean_cache[ctx.guild.id] = dehoist, enable
-        except KeyError:
-            pass
+        await config.update(auto_clean_normalize=enable)
 
         enabled_str = "will now" if enable else "will no longer"
         await ctx.reply(
@@ -310,45 +298,98 @@ class Chat(cmd.Cog):
         )
 
     message_link_re = re.compile(
-        r"https?://(?:(ptb|canary|www)\.)?discord(?:app)?\.com/channels/\d+/\d+/\d+"
+        r"https?://(?:(ptb|canary|www)\.)?discord(?:app)?\.com/channels/\d+/\d+/(?P<message_id>\d+)"
     )
     IMAGE_CONTENT_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
 
+    # Messages with links embedded per channel, and embeds running at once
+    embed_cooldown = commands.CooldownMapping.from_cooldown(
+        5, 10, commands.BucketType.channel
+    )
+    max_embeds_in_flight = 20
+    embeds_shed = collections.Counter()
+
+    # Linked messages and their author as a member, by message ID
+    linked_messages_cache = cachetools.TTLCache(maxsize=1024, ttl=600)
+
+    @cmd.raw_listener("MESSAGE_UPDATE", "MESSAGE_DELETE")
+    async def handle_message_change(self, data: dict):
+        self.linked_messages_cache.pop(int(data["id"]), None)
+
+    @cmd.raw_listener("MESSAGE_DELETE_BULK")
+    async def handle_message_delete_bulk(self, data: dict):
+        for message_id in data["ids"]:
+            self.linked_messages_cache.pop(int(message_id), None)
+
+    async def get_linked_message(self, ctx: cmd.Context, link: str):
+        message_id = int(self.message_link_re.fullmatch(link)["message_id"])
+
+        try:
+            linked_message, author = self.linked_messages_cache[message_id]
+        except KeyError:
+            pass
+        else:
+            converter.MessageConverter.check_readable(ctx, linked_message)
+            return linked_message, author
+
+        linked_message = await converter.MessageConverter().convert(ctx, link)
+
+        author = linked_message.author
+        try:
+            author = await ctx.guild.fetch_member(author.id)
+        except discord.NotFound:
+            pass
+
+        self.linked_messages_cache[message_id] = linked_message, author
+        return linked_message, author
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if not message.guild or message.author.bot:
             return
 
-        conv = converter.MessageConverter()
-        ctx = await self.bot.get_context(message, cls=cmd.Context)
-        linked_messages = []
-        for word in message.content.split():
-            if self.message_link_re.fullmatch(word):
-                try:
-                    linked_messages.append(await conv.convert(ctx, word))
-                except:
-                    pass
-        if len(linked_messages) == 0:
+        config = await self.bot.guild_configs.get(message.guild.id)
+        if not config.embed_messages:
             return
 
-        embed_messages = await self.bot.pool.fetchval(
-            """
-            SELECT embed_messages FROM guild_config
-            WHERE guild_id = $1
-            """,
-            message.guild.id,
-        )
+        match = await self.bot.match_message(message)
+        if not match["link"]:
+            return
 
-        if not embed_messages:
+        links = [
+            word
+            for word in message.content.split()
+            if self.message_link_re.fullmatch(word)
+        ]
+        if not links:
             return
 
-        for linked_message in linked_messages[:3]:
-            author = linked_message.author
-            try:
-                author = await message.guild.fetch_member(linked_message.author.id)
-            except discord.NotFound:
-                pass
+        if self.embed_cooldown.get_bucket(message).update_rate_limit():
+            self.embeds_shed["Rate limited"] += 1
+            return
+        if self.embeds_in_flight >= self.max_embeds_in_flight:
+            self.embeds_shed["Overloaded"] += 1
+            return
+
+        self.embeds_in_flight += 1
+        try:
+            await self.embed_linked_messages(message, links)
+        finally:
+            self.embeds_in_flight -= 1
+
+    async def embed_linked_messages(self, message: discord.Message, links):
+        ctx = await self.bot.get_message_context(message)
+        results = await asyncio.gather(
+            *(self.get_linked_message(ctx, link) for link in links[:3]),
+            return_exceptions=True,
+        )
+        linked_messages = [
+            result for result in results if not isinstance(result, BaseException)
+        ]
+        if not linked_messages:
+            return
 
+        for linked_message, author in linked_messages:
             embed = discord.Embed(
                 description=linked_message.content,
                 timestamp=linked_message.created_at,
@@ -375,37 +416,27 @@ class Chat(cmd.Cog):
                 allowed_mentions=discord.AllowedMentions.none(),
             )
 
-        if len(linked_messages) > 3:
-            message_plural = "message" if len(linked_messages) == 4 else "messages"
+        if len(links) > 3:
+            message_plural = "message" if len(links) == 4 else "messages"
             await message.reply(
-                f"Aborted embedding {len(linked_messages) - 3} more {message_plural}.",
+                f"Aborted embedding {len(links) - 3} more {message_plural}.",
                 allowed_mentions=discord.AllowedMentions.none(),
             )
 
-    auto_clean_cache = cachetools.TTLCache(maxsize=float("inf"), ttl=900)
-
     async def get_auto_clean_status(self, guild: discord.Guild):
-        try:
-            return self.auto_clean_cache[guild.id]
-        except KeyError:
-            row = await self.bot.pool.fetchrow(
-                """
-                SELECT auto_clean_dehoist, auto_clean_normalize FROM guild_config
-                WHERE guild_id = $1
-                """,
-                guild.id,
-            )
-            if not row:
-                return False, False
-
-            dehoist = row["auto_clean_dehoist"]
-            normalize = row["auto_clean_normalize"]
-            self.auto_clean_cache[guild.id] = dehoist, normalize
+        config = await self.bot.guild_configs.get(guild.id)
 
-            return await self.get_auto_clean_status(guild)
+        return config.auto_clean_dehoist, config.auto_clean_normalize
 
     cleaned_usernames_cache = cachetools.TTLCache(maxsize=float("inf"), ttl=900)
 
+    # Hash of the last (nick, username) handled per member, per guild
+    seen_names = collections.defaultdict(dict)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.seen_names.pop(guild.id, None)
+
     async def get_cleaned_usernames(self, guild: discord.Guild):
         try:
             return self.cleaned_usernames_cache[guild.id]
@@ -417,11 +448,52 @@ class Chat(cmd.Cog):
                 """,
                 guild.id,
             )
-            self.cleaned_usernames_cache[guild.id] = {
-                row["member_id"]: row["nick"] for row in nicks
-            }
+            nicks = MemberNickMap((row["member_id"], row["nick"]) for row in nicks)
+
+            # Apply writes that are not committed yet
+            for (guild_id, member_id), nick in self.cleaned_username_writes.items():
+                if guild_id != guild.id:
+                    continue
+
+                if nick is None:
+                    nicks.pop(member_id, None)
+                else:
+                    nicks[member_id] = nick
+
+            self.cleaned_usernames_cache[guild.id] = nicks
             return await self.get_cleaned_usernames(guild)
 
+    async def write_cleaned_usernames(self, pending: dict):
+        upserts = [(*key, nick) for key, nick in pending.items() if nick is not None]
+        deletes = [key for key, nick in pending.items() if nick is None]
+
+        async with self.bot.pool.acquire() as connection:
+            async with connection.transaction():
+                if deletes:
+                    await connection.execute(
+                        """
+                        DELETE FROM cleaned_username
+                        USING unnest($1::BIGINT[], $2::BIGINT[]) AS d (guild_id, member_id)
+                        WHERE cleaned_username.guild_id = d.guild_id
+                        AND cleaned_username.member_id = d.member_id
+                        """,
+                        *zip(*deletes),
+                    )
+
+                if upserts:
+                    await connection.execute(
+                        """
+                        INSERT INTO cleaned_username (guild_id, member_id, nick)
+                        SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::TEXT[])
+                        ON CONFLICT (guild_id, member_id) DO UPDATE
+                        SET nick = EXCLUDED.nick
+                        """,
+                        *zip(*upserts),
+                    )
+
+    async def cog_close(self):
+        await self.cleaned_username_writes.flush()
+
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         if member.bot or not member.guild.me.guild_permissions.manage_nicknames:
@@ -440,114 +512,85 @@ class Chat(cmd.Cog):
         if not new_nick:
             new_nick = "{cleaned}"
         if member.display_name != new_nick:
-            await member.edit(nick=new_nick)
+            queued = self.bot.member_edits.edit(
+                member.guild.id, member.id, nick=new_nick
+            )
 
-            if mark_as_managed:
+            if queued and mark_as_managed:
                 nicks = await self.get_cleaned_usernames(member.guild)
                 nicks[member.id] = new_nick
-                await self.bot.pool.execute(
-                    """
-                    INSERT INTO cleaned_username (guild_id, member_id, nick)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT DO NOTHING
-                    """,
-                    member.guild.id,
-                    member.id,
-                    new_nick,
-                )
+                self.cleaned_username_writes.put((member.guild.id, member.id), new_nick)
 
-    @commands.Cog.listener()
-    async def on_socket_response(self, event: dict):
-        if event["op"] != gateway.DiscordWebSocket.DISPATCH:
+    @cmd.raw_listener("GUILD_MEMBER_UPDATE")
+    async def handle_member_update(self, data: dict):
+        if data["user"].get("bot", False):
             return
 
-        data = event["d"]
+        guild = self.bot.get_guild(int(data["guild_id"]))
+        user_id = int(data["user"]["id"])
 
-        if event["t"] == "GUILD_MEMBER_UPDATE":
-            if data["user"].get("bot", False):
-                return
+        if guild.owner_id == user_id:
+            return
+        if not guild.me.guild_permissions.manage_nicknames:
+            return
 
-            guild = self.bot.get_guild(int(data["guild_id"]))
-            user_id = int(data["user"]["id"])
+        target_top_role = max(
+            (guild.get_role(int(role_id)) for role_id in data["roles"]),
+            default=guild.default_role,
+        )
+        if target_top_role >= guild.me.top_role:
+            return
 
-            if guild.owner_id == user_id:
-                return
-            if not guild.me.guild_permissions.manage_nicknames:
-                return
+        dehoist, normalize = await self.get_auto_clean_status(guild)
+        if not dehoist and not normalize:
+            return
 
-            target_top_role = max(
-                (guild.get_role(int(role_id)) for role_id in data["roles"]),
-                default=guild.default_role,
-            )
-            if target_top_role >= guild.me.top_role:
-                return
+        nick = data.get("nick")
+        username = data["user"]["username"]
 
-            dehoist, normalize = await self.get_auto_clean_status(guild)
-            if not dehoist and not normalize:
-                return
+        # Most updates are role changes, skip those that did not touch names
+        seen_names = self.seen_names[guild.id]
+        if seen_names.get(user_id) == hash((nick, username)):
+            return
+        seen_names[user_id] = hash((nick, username))
 
-            nicks = await self.get_cleaned_usernames(guild)
-            member = await guild.fetch_member(user_id)
+        nicks = await self.get_cleaned_usernames(guild)
 
-            display_name = (
-                member.name
-                if member.nick == nicks.get(member.id)
-                else member.display_name
-            )
-            is_username = member.name == display_name
+        display_name = username if nick == nicks.get(user_id) else nick or username
+        is_username = username == display_name
 
-            new_nick = self.clean_display_name(
-                display_name, normalize=normalize, dehoist=dehoist
-            )
-            if not new_nick:
-                new_nick = "{cleaned}"
-
-            if not is_username or new_nick == display_name and user_id in nicks:
-                nicks.pop(user_id, None)
-                await self.bot.pool.execute(
-                    """
-                    DELETE FROM cleaned_username
-                    WHERE guild_id = $1 AND member_id = $2
-                    """,
-                    guild.id,
-                    user_id,
-                )
-            elif is_username and nicks.get(user_id) != new_nick:
-                nicks[user_id] = new_nick
-                await self.bot.pool.execute(
-                    """
-                    INSERT INTO cleaned_username (guild_id, member_id, nick)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (guild_id, member_id) DO UPDATE
-                    SET nick = $3
-                    """,
-                    guild.id,
-                    user_id,
-                    new_nick,
-                )
+        new_nick = self.clean_display_name(
+            display_name, normalize=normalize, dehoist=dehoist
+        )
+        if not new_nick:
+            new_nick = "{cleaned}"
 
-            if new_nick != member.display_name:
-                await member.edit(nick=new_nick)
+        if not is_username or new_nick == display_name and user_id in nicks:
+            nicks.pop(user_id, None)
+            self.cleaned_username_writes.put((guild.id, user_id), None)
+        elif is_username and nicks.get(user_id) != new_nick:
+            nicks[user_id] = new_nick
+            self.cleaned_username_writes.put((guild.id, user_id), new_nick)
 
-        if event["t"] == "GUILD_MEMBER_REMOVE":
-            if data["user"].get("bot", False):
-                return
+        if new_nick != (nick or username):
+            if self.bot.member_edits.edit(guild.id, user_id, nick=new_nick):
+                seen_names[user_id] = hash((new_nick, username))
 
-            guild = self.bot.get_guild(int(data["guild_id"]))
-            user_id = int(data["user"]["id"])
+    @cmd.raw_listener("GUILD_MEMBER_REMOVE")
+    async def handle_member_remove(self, data: dict):
+        if data["user"].get("bot", False):
+            return
 
-            nicks = await self.get_cleaned_usernames(guild)
+        guild = self.bot.get_guild(int(data["guild_id"]))
+        user_id = int(data["user"]["id"])
 
-            if user_id in nicks:
-                nicks.pop(user_id, None)
-                await self.bot.pool.execute(
-                    """
-                    DELETE FROM cleaned_username
-                    WHERE guild_id = $1 AND member_id = $2
-                    """,
-                    guild.id,
-                    user_id,
-                )
+        self.seen_names[guild.id].pop(user_id, None)
+
+        nicks = await self.get_cleaned_usernames(guild)
+
+        if user_id in nicks:
+            nicks.pop(user_id, None)
+            self.cleaned_username_writes.put((guild.id, user_id), None)
 
 
 def setup(bot: commands.Bot):
@@ -0,0 +1,64 @@
+import discord
+from bot import cmd, menus
+from discord.ext import commands
+
+
+class Jobs(cmd.Cog):
+    """Long running server wide operations"""
+
+    @commands.group(invoke_without_command=True)
+    @commands.cooldown(3, 8, commands.BucketType.channel)
+    @commands.has_guild_permissions(manage_guild=True)
+    async def jobs(self, ctx: cmd.Context):
+        """Lists jobs in this server"""
+
+        jobs = await self.bot.jobs.fetch_guild_jobs(ctx.guild.id)
+
+        if len(jobs) == 0:
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Jobs",
+                    description="There are no jobs in this server.",
+                )
+            )
+            return
+
+        paginator = menus.FieldPaginator(
+            self.bot, base_embed=discord.Embed(title="Jobs")
+        )
+
+        for job in jobs:
+            paginator.add_field(
+                name=f"#{job.job_id} {job.job_type.title}",
+                value=job.get_embed().description,
+                inline=False,
+            )
+
+        await paginator.send(ctx)
+
+    @jobs.command(name="cancel")
+    @commands.cooldown(3, 8, commands.BucketType.guild)
+    @commands.has_guild_permissions(manage_guild=True)
+    async def jobs_cancel(self, ctx: cmd.Context, job_id: int):
+        """Cancels a job"""
+
+        if not await self.bot.jobs.cancel(ctx.guild.id, job_id):
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Jobs",
+                    description=f"There is no job #{job_id} in this server.",
+                )
+            )
+            return
+
+        await ctx.reply(
+            embed=discord.Embed(
+                title="Jobs",
+                description=f"Cancelled job #{job_id}.",
+            )
+        )
+
+
+def setup(bot: commands.Bot):
+    jobs = Jobs(bot)
+    bot.add_cog(jobs)
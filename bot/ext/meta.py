@@ -19,20 +19,12 @@ class Meta(cmd.Cog):
     ):
         """Manages server prefix for the bot"""
 
+        config = await self.bot.guild_configs.get(ctx.guild.id)
+
         if new_prefix:
             await commands.has_guild_permissions(manage_guild=True).predicate(ctx)
 
-            await self.bot.pool.execute(
-                """
-                UPDATE guild_config
-                SET prefix = $2
-                WHERE guild_id = $1
-                """,
-                ctx.guild.id,
-                new_prefix,
-            )
-
-            ctx.bot.prefix_cache[ctx.guild.id] = new_prefix
+            await config.update(prefix=new_prefix)
 
             await ctx.reply(
                 embed=discord.Embed(
@@ -42,17 +34,9 @@ class Meta(cmd.Cog):
             )
             return
 
-        prefix = await self.bot.pool.fetchval(
-            """
-            SELECT prefix FROM guild_config
-            WHERE guild_id = $1
-            """,
-            ctx.guild.id,
-        )
-
         embed = discord.Embed(
             title="Prefix",
-            description=f"The current server prefix is {wrap_in_code(prefix)}."
+            description=f"The current server prefix is {wrap_in_code(config.prefix)}."
             f"\nUse {get_command_signature(ctx, self.prefix)} to set it.",
         )
 
@@ -79,6 +63,52 @@ class Meta(cmd.Cog):
 
         await ctx.reply(embed=embed)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def stats(self, ctx: cmd.Context):
+        """Shows internal counters of the bot"""
+
+        embed = discord.Embed(title="Stats")
+        embed.add_field(
+            name="Gateway events",
+            value=wrap_in_code(
+                "\n".join(
+                    f"{event_type}: {count}"
+                    for event_type, count in self.bot.raw_event_counts.most_common(20)
+                )
+                or "None",
+                block=True,
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="Member edit queue",
+            value=f"Depth: {self.bot.member_edits.depth()}"
+            f"\nShed: {self.bot.member_edits.shed}",
+            inline=False,
+        )
+
+        chat = self.bot.get_cog("Chat")
+        if chat:
+            embed.add_field(
+                name="Message link embeds",
+                value=f"In flight: {chat.embeds_in_flight}"
+                f"\nRate limited: {chat.embeds_shed['Rate limited']}"
+                f"\nOverloaded: {chat.embeds_shed['Overloaded']}",
+                inline=False,
+            )
+
+        voice = self.bot.get_cog("Voice")
+        if voice:
+            embed.add_field(
+                name="Overwrite queue",
+                value=f"Depth: {voice.overwrite_queue.depth()}"
+                f"\nDropped: {voice.overwrite_queue.dropped}",
+                inline=False,
+            )
+
+        await ctx.reply(embed=embed)
+
 
 def setup(bot: commands.Bot):
     meta = Meta(bot)
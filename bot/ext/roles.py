@@ -1,10 +1,11 @@
+import asyncio
+
 import cachetools
 import discord
-from bot import cmd
-from bot.utils import get_command_signature, wrap_in_code
-from discord import gateway
+from bot import cmd, jobs
+from bot.utils import get_command_signature, join_lines, wrap_in_code
 from discord.ext import commands
-from discord.utils import get
+from discord.http import Route
 
 # format: written, nominative, accusative, pronominal possessive, predicative possessive, reflexive
 pronoun_list = [
@@ -33,30 +34,38 @@ pronoun_list = [
     ("no pronouns", "[name]", "[name]", "[name]'s", "[name]'s", "[name]"),
 ]
 
+# Pronoun entries by case-folded written form, and by their first part
+pronoun_index = {}
+for entry in pronoun_list:
+    pronoun_index.setdefault(entry[0].casefold(), entry)
+for entry in pronoun_list:
+    pronoun_index.setdefault(entry[0].split("/")[0].casefold(), entry)
 
-def pronouns_enabled():
-    async def extended_check(ctx):
-        await commands.guild_only().predicate(ctx)
-
-        enabled = await ctx.bot.pool.fetchval(
-            """
-            SELECT selfrole_pronoun FROM guild_config
-            WHERE guild_id = $1
-            """,
-            ctx.guild.id,
-        )
-
-        if not enabled:
-            raise commands.DisabledCommand()
+pronoun_written_forms = frozenset(entry[0] for entry in pronoun_list)
 
-        return True
 
-    return commands.check(extended_check)
+def pronouns_enabled():
+    return cmd.config_flag("selfrole_pronoun")
 
 
 class Roles(cmd.Cog):
     """Role related commands"""
 
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        bot.jobs.add_type(
+            "autorole_backfill",
+            self.plan_autorole,
+            title="Autorole",
+            action="Assigning the autorole",
+        )
+
+    def cog_unload(self):
+        super().cog_unload()
+
+        self.bot.jobs.remove_type("autorole_backfill")
+
     @commands.group(invoke_without_command=True)
     @commands.cooldown(3, 8, commands.BucketType.guild)
     @commands.has_guild_permissions(manage_roles=True)
@@ -71,16 +80,9 @@ class Roles(cmd.Cog):
     async def roleconfig_add(self, ctx: cmd.Context, *, role: discord.Role):
         """Adds a role to the list of self-assignable roles"""
 
-        in_db = await ctx.bot.pool.fetchval(
-            """
-            SELECT $1 = ANY(selfrole) FROM guild_config
-            WHERE guild_id = $2
-            """,
-            role.id,
-            ctx.guild.id,
-        )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-        if in_db:
+        if role.id in config.selfrole:
             await ctx.reply(
                 embed=discord.Embed(
                     title="Selfroles",
@@ -89,15 +91,7 @@ class Roles(cmd.Cog):
             )
             return
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET selfrole = array_append(selfrole, $1)
-            WHERE guild_id = $2
-            """,
-            role.id,
-            ctx.guild.id,
-        )
+        await config.add_selfrole(role.id)
         await ctx.reply(
             embed=discord.Embed(
                 title="Selfroles",
@@ -111,16 +105,9 @@ class Roles(cmd.Cog):
     async def roleconfig_remove(self, ctx: cmd.Context, *, role: discord.Role):
         """Removes a role to the list of self-assignable roles"""
 
-        in_db = await ctx.bot.pool.fetchval(
-            """
-            SELECT $1 = ANY(selfrole) FROM guild_config
-            WHERE guild_id = $2
-            """,
-            role.id,
-            ctx.guild.id,
-        )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-        if not in_db:
+        if role.id not in config.selfrole:
             await ctx.reply(
                 embed=discord.Embed(
                     title="Selfroles",
@@ -129,15 +116,7 @@ class Roles(cmd.Cog):
             )
             return
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET selfrole = array_remove(selfrole, $1)
-            WHERE guild_id = $2
-            """,
-            role.id,
-            ctx.guild.id,
-        )
+        await config.remove_selfroles([role.id])
         await ctx.reply(
             embed=discord.Embed(
                 title="Selfroles",
@@ -151,16 +130,10 @@ class Roles(cmd.Cog):
     async def roleconfig_pronoun(self, ctx: cmd.Context, enable: bool = None):
         """Gets or sets if pronoun selfroles are enabled"""
 
-        if enable is None:
-            enabled = await ctx.bot.pool.fetchval(
-                """
-                SELECT selfrole_pronoun FROM guild_config
-                WHERE guild_id = $1
-                """,
-                ctx.guild.id,
-            )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-            enabled_str = "enabled" if enabled else "disabled"
+        if enable is None:
+            enabled_str = "enabled" if config.selfrole_pronoun else "disabled"
             await ctx.reply(
                 embed=discord.Embed(
                     title="Pronoun selfrole",
@@ -170,15 +143,7 @@ class Roles(cmd.Cog):
             )
             return
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET selfrole_pronoun = $1
-            WHERE guild_id = $2
-            """,
-            enable,
-            ctx.guild.id,
-        )
+        await config.update(selfrole_pronoun=enable)
 
         enabled_str = "enabled" if enable else "disabled"
         await ctx.reply(
@@ -193,27 +158,12 @@ class Roles(cmd.Cog):
     async def selfroles(self, ctx: cmd.Context):
         """Lists all self-assignable roles"""
 
-        role_ids = await ctx.bot.pool.fetchval(
-            """
-            SELECT selfrole FROM guild_config
-            WHERE guild_id = $1
-            """,
-            ctx.guild.id,
-        )
-        role_ids_in_db = len(role_ids)
-
-        role_ids = {rid for rid in role_ids if ctx.guild.get_role(rid)}
-
-        if len(role_ids) != role_ids_in_db:
-            await ctx.bot.pool.execute(
-                """
-                UPDATE guild_config
-                SET selfrole = $1
-                WHERE guild_id = $2
-                """,
-                list(role_ids),
-                ctx.guild.id,
-            )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
+
+        role_ids = {rid for rid in config.selfrole if ctx.guild.get_role(rid)}
+
+        if len(role_ids) != len(config.selfrole):
+            await config.remove_selfroles(config.selfrole - role_ids)
 
         if len(role_ids) == 0:
             await ctx.reply(
@@ -239,16 +189,9 @@ class Roles(cmd.Cog):
     async def assign(self, ctx: cmd.Context, *, role: discord.Role):
         """Toggles a self-assignable role on you"""
 
-        in_db = await ctx.bot.pool.fetchval(
-            """
-            SELECT $1 = ANY(selfrole) FROM guild_config
-            WHERE guild_id = $2
-            """,
-            role.id,
-            ctx.guild.id,
-        )
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
 
-        if not in_db:
+        if role.id not in config.selfrole:
             await ctx.reply(
                 embed=discord.Embed(
                     title="Selfroles",
@@ -281,13 +224,7 @@ class Roles(cmd.Cog):
     async def pronoun(self, ctx: cmd.Context, *, pronoun: str):
         """Assigns or unassigns a pronoun role"""
 
-        selected_pronoun = None
-
-        for entry in pronoun_list:
-            written_form = entry[0]
-            if pronoun == written_form or pronoun == written_form.split("/")[0]:
-                selected_pronoun = written_form
-                break
+        selected_pronoun = pronoun_index.get(pronoun.casefold())
 
         if not selected_pronoun:
             await ctx.reply(
@@ -299,12 +236,14 @@ class Roles(cmd.Cog):
             )
             return
 
-        role = get(ctx.guild.roles, name=selected_pronoun)
-        if role.permissions != discord.Permissions.none():
-            await role.edit(permissions=discord.Permissions.none())
+        written_form = selected_pronoun[0]
 
+        role = ctx.guild.get_role(self.get_pronoun_roles(ctx.guild).get(written_form))
         if not role:
-            role = await ctx.guild.create_role(name=selected_pronoun)
+            role = await ctx.guild.create_role(name=written_form)
+
+        if role.permissions != discord.Permissions.none():
+            await role.edit(permissions=discord.Permissions.none())
 
         if role not in ctx.author.roles:
             await ctx.author.add_roles(role)
@@ -342,13 +281,7 @@ class Roles(cmd.Cog):
     async def pronouninfo(self, ctx: cmd.Context, *, pronoun: str):
         """Gives examples on how to use a pronoun"""
 
-        selected_pronoun = None
-
-        for entry in pronoun_list:
-            written_form = entry[0]
-            if pronoun == written_form or pronoun == written_form.split("/")[0]:
-                selected_pronoun = entry
-                break
+        selected_pronoun = pronoun_index.get(pronoun.casefold())
 
         if not selected_pronoun:
             await ctx.reply(
@@ -367,7 +300,7 @@ class Roles(cmd.Cog):
             pronominal_possessive,
             predicative_possessive,
             reflexive,
-        ) = entry
+        ) = selected_pronoun
 
         embed = discord.Embed(
             title=written_form,
@@ -389,39 +322,74 @@ class Roles(cmd.Cog):
 
         await ctx.reply(embed=embed)
 
-    autorole_cache = cachetools.TTLCache(maxsize=float("inf"), ttl=900)
+    # Pronoun role IDs by written form, per guild
+    pronoun_roles = {}
 
-    async def get_autorole(self, guild: discord.Guild):
+    def get_pronoun_roles(self, guild: discord.Guild):
         try:
-            return self.autorole_cache[guild.id]
+            return self.pronoun_roles[guild.id]
         except KeyError:
-            self.autorole_cache[guild.id] = await self.bot.pool.fetchval(
-                """
-                SELECT autorole_id FROM guild_config
-                WHERE guild_id = $1
-                """,
-                guild.id,
-            )
+            pass
 
-            return await self.get_autorole(guild)
+        roles = self.pronoun_roles[guild.id] = {}
+        for role in guild.roles:
+            if role.name in pronoun_written_forms:
+                roles.setdefault(role.name, role.id)
 
-    @commands.command()
+        return roles
+
+    def forget_pronoun_role(self, role: discord.Role, name: str):
+        roles = self.pronoun_roles.get(role.guild.id)
+        if roles is None or roles.get(name) != role.id:
+            return
+
+        # Fall back to another role with the same name, if there is one
+        other = discord.utils.find(
+            lambda r: r.name == name and r.id != role.id, role.guild.roles
+        )
+        if other:
+            roles[name] = other.id
+        else:
+            del roles[name]
+
+    def remember_pronoun_role(self, role: discord.Role):
+        roles = self.pronoun_roles.get(role.guild.id)
+        if roles is not None and role.name in pronoun_written_forms:
+            roles.setdefault(role.name, role.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        self.remember_pronoun_role(role)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name:
+            self.forget_pronoun_role(after, before.name)
+            self.remember_pronoun_role(after)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.pronoun_roles.pop(guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.forget_pronoun_role(role, role.name)
+
+        if role.guild.id not in self.bot.guild_configs:
+            return
+
+        config = await self.bot.guild_configs.get(role.guild.id)
+        if role.id in config.selfrole:
+            await config.remove_selfroles([role.id])
+
+    @commands.group(invoke_without_command=True)
     @commands.cooldown(3, 8, commands.BucketType.guild)
     @commands.has_guild_permissions(manage_roles=True)
     async def autorole(self, ctx: cmd.Context, *, role: discord.Role = None):
         """Configures an autorole for this server"""
 
-        await ctx.bot.pool.execute(
-            """
-            UPDATE guild_config
-            SET autorole_id = $2
-            WHERE guild_id = $1
-            """,
-            ctx.guild.id,
-            role.id if role else None,
-        )
-
-        self.autorole_cache[ctx.guild.id] = role.id if role else None
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
+        await config.update(autorole_id=role.id if role else None)
 
         await ctx.reply(
             embed=discord.Embed(
@@ -432,40 +400,108 @@ class Roles(cmd.Cog):
             )
         )
 
-    @commands.Cog.listener()
-    async def on_socket_response(self, event: dict):
-        if event["op"] != gateway.DiscordWebSocket.DISPATCH:
+    # Autoroles queued per (guild ID, member ID, role ID), until the gateway
+    # shows them on the member. Forgotten after a while in case a grant failed.
+    autorole_grants = cachetools.TTLCache(maxsize=100000, ttl=300)
+
+    @cmd.raw_listener("GUILD_MEMBER_ADD", "GUILD_MEMBER_UPDATE")
+    async def handle_member_update(self, data: dict):
+        if data["user"].get("bot", False):
+            return
+
+        guild = self.bot.get_guild(int(data["guild_id"]))
+        config = await self.bot.guild_configs.get(guild.id)
+        role_id = config.autorole_id
+        if role_id is None:
+            return
+
+        member_id = int(data["user"]["id"])
+        key = (guild.id, member_id, role_id)
+
+        if str(role_id) in data["roles"]:
+            self.autorole_grants.pop(key, None)
+            return
+        if data.get("pending", True) or key in self.autorole_grants:
+            return
+
+        role = guild.get_role(role_id)
+        if not role:
+            await config.update(autorole_id=None)
+            return
+
+        if guild.me.top_role > role:
+            queued = self.bot.member_edits.edit(
+                guild.id,
+                member_id,
+                add_role_ids=[role_id],
+            )
+            if queued:
+                self.autorole_grants[key] = True
+
+    def plan_autorole(self, job: jobs.Job, member: discord.Member):
+        config = self.bot.guild_configs.cache.get(member.guild.id)
+        if not config or config.autorole_id is None:
+            return
+
+        role = member.guild.get_role(config.autorole_id)
+        if not role or member.bot or member.pending or role in member.roles:
             return
 
-        data = event["d"]
-
-        if event["t"] in {"GUILD_MEMBER_ADD", "GUILD_MEMBER_UPDATE"}:
-            if data["user"].get("bot", False):
-                return
-
-            guild = self.bot.get_guild(int(data["guild_id"]))
-            role_id = await self.get_autorole(guild)
-            role = guild.get_role(role_id)
-
-            if not data.get("pending", True) and str(role_id) not in data["roles"]:
-                member = None
-                try:
-                    member = await guild.fetch_member(int(data["user"]["id"]))
-                except discord.NotFound:
-                    pass
-
-                if member and role:
-                    if guild.me.top_role > role:
-                        await member.add_roles(role)
-                elif not role:
-                    await self.bot.pool.execute(
-                        """
-                        UPDATE guild_config
-                        SET autorole_id = NULL
-                        WHERE guild_id = $1
-                        """,
-                        guild.id,
-                    )
+        route = Route(
+            "PUT",
+            "/guilds/{guild_id}/members/{user_id}/roles/{role_id}",
+            guild_id=member.guild.id,
+            user_id=member.id,
+            role_id=role.id,
+        )
+        job.add(
+            route.bucket,
+            self.bot.http.add_role,
+            member.guild.id,
+            member.id,
+            role.id,
+        )
+
+    @autorole.command(name="backfill")
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    @commands.has_guild_permissions(manage_roles=True)
+    @commands.bot_has_guild_permissions(manage_roles=True)
+    async def autorole_backfill(self, ctx: cmd.Context):
+        """Assigns the autorole to members who joined before it was set"""
+
+        config = await ctx.bot.guild_configs.get(ctx.guild.id)
+        role = ctx.guild.get_role(config.autorole_id or 0)
+
+        if not role:
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Autorole",
+                    description="There is no autorole in this server.",
+                )
+            )
+            return
+
+        if role >= ctx.guild.me.top_role:
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Autorole",
+                    description=f"{role.mention} is above my highest role.",
+                )
+            )
+            return
+
+        job = await self.bot.jobs.create("autorole_backfill", ctx)
+
+        if job is None:
+            await ctx.reply(
+                embed=discord.Embed(
+                    title="Autorole",
+                    description="The autorole is already being assigned in this server.",
+                )
+            )
+
+    sync_concurrency = 4
+    sync_timeout = 30
 
     @commands.command()
     @commands.cooldown(1, 60, commands.BucketType.guild)
@@ -485,16 +521,51 @@ class Roles(cmd.Cog):
             )
             return
 
-        for integration in integrations:
-            await integration.sync()
+        semaphore = asyncio.Semaphore(self.sync_concurrency)
 
-        await ctx.reply(
-            embed=discord.Embed(
+        async def sync_integration(integration):
+            async with semaphore:
+                await asyncio.wait_for(integration.sync(), self.sync_timeout)
+
+        results = await asyncio.gather(
+            *map(sync_integration, integrations), return_exceptions=True
+        )
+
+        synced = []
+        failed = []
+        for integration, result in zip(integrations, results):
+            line = f"{integration.type}: {integration.name}"
+            if result is None:
+                synced.append(line)
+            elif isinstance(result, asyncio.TimeoutError):
+                # Includes time spent waiting on the rate limit of the guild,
+                # the sync might not have been sent at all
+                failed.append(f"{line} (no response in {self.sync_timeout}s)")
+            elif isinstance(result, discord.HTTPException):
+                failed.append(f"{line} ({result.text or result.status})")
+            else:
+                raise result
+
+        if not failed:
+            embed = discord.Embed(
                 title="Sync",
                 description="Synced all integrations:\n"
-                + "\n".join(map(lambda i: f"{i.type}: {i.name}", integrations)),
+                + join_lines(synced, limit=2000),
             )
-        )
+        else:
+            embed = discord.Embed(
+                title="Sync",
+                description=f"Synced {len(synced)} of {len(integrations)} integrations.",
+            )
+            if synced:
+                embed.add_field(
+                    name="Synced", value=join_lines(synced, limit=1024), inline=False
+                )
+            embed.add_field(
+                name="Failed", value=join_lines(failed, limit=1024), inline=False
+            )
+
+        await ctx.reply(embed=embed)
 
 
 def setup(bot: commands.Bot):
@@ -1,16 +1,177 @@
+import collections
 import itertools
 import typing
 
 import discord
 from bot import cmd, menus
+from bot.overwrites import OverwriteQueue
 from bot.utils import patch_overwrites, wrap_in_code
 from discord.ext import commands
-from discord.utils import get
 
 
 class Voice(cmd.Cog):
     """Voice chat helpers"""
 
+    # Text channel IDs linked to each voice channel ID, per guild
+    voice_links = {}
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.overwrite_queue = OverwriteQueue(bot)
+
+    async def cog_close(self):
+        await self.overwrite_queue.flush()
+
+    async def load_voice_links(self, guild_ids):
+        guild_ids = list(guild_ids)
+        if not guild_ids:
+            return
+
+        records = await self.bot.pool.fetch(
+            """
+            SELECT guild_id, text_channel_id, voice_channel_id FROM voice_link
+            WHERE guild_id = ANY($1::BIGINT[])
+            """,
+            guild_ids,
+        )
+
+        links = {guild_id: collections.defaultdict(set) for guild_id in guild_ids}
+        for record in records:
+            links[record["guild_id"]][record["voice_channel_id"]].add(
+                record["text_channel_id"]
+            )
+
+        for guild_id, guild_links in links.items():
+            self.voice_links[guild_id] = {
+                voice_channel_id: frozenset(text_channel_ids)
+                for voice_channel_id, text_channel_ids in guild_links.items()
+            }
+
+    async def get_voice_links(self, guild: discord.Guild):
+        try:
+            return self.voice_links[guild.id]
+        except KeyError:
+            await self.load_voice_links([guild.id])
+
+            return self.voice_links[guild.id]
+
+    def forget_channel(self, guild_id: int, channel_id: int):
+        """Removes all links of a voice or text channel from the index."""
+
+        links = self.voice_links.get(guild_id)
+        if links is None:
+            return
+
+        links.pop(channel_id, None)
+
+        for voice_channel_id, text_channel_ids in list(links.items()):
+            if channel_id in text_channel_ids:
+                text_channel_ids = text_channel_ids - {channel_id}
+                if text_channel_ids:
+                    links[voice_channel_id] = text_channel_ids
+                else:
+                    del links[voice_channel_id]
+
+    def reconcile_overwrites(self, guild: discord.Guild):
+        """Queues the overwrite changes needed to match current voice states.
+
+        Members are meant to have a ``read_messages`` overwrite in exactly the
+        text channels linked to the voice channel they are connected to, which
+        drifts when members join or leave while the bot is offline. Returns
+        the number of changes queued.
+        """
+
+        links = self.voice_links.get(guild.id)
+        if not links:
+            return 0
+
+        # Bots are left alone by on_voice_state_update. Without a member cache
+        # only the bot itself and cached bots can be told apart
+        def is_ignored(member_id):
+            member = guild.get_member(member_id)
+            return member_id == guild.me.id or (member is not None and member.bot)
+
+        desired = collections.defaultdict(set)
+        for voice_channel_id, text_channel_ids in links.items():
+            voice_channel = guild.get_channel(voice_channel_id)
+            if not voice_channel:
+                continue
+
+            member_ids = {
+                member_id
+                for member_id in voice_channel.voice_states
+                if not is_ignored(member_id)
+            }
+            for text_channel_id in text_channel_ids:
+                desired[text_channel_id] |= member_ids
+
+        read_messages = discord.Permissions(read_messages=True).value
+
+        changes = 0
+        for text_channel_id in frozenset().union(*links.values()):
+            channel = guild.get_channel(text_channel_id)
+            if not channel or not channel.permissions_for(guild.me).manage_roles:
+                continue
+
+            granted = {
+                overwrite.id
+                for overwrite in channel._overwrites
+                if overwrite.type == "member"
+                and overwrite.allow & read_messages
+                and not is_ignored(overwrite.id)
+            }
+
+            for member_id in desired[text_channel_id] - granted:
+                self.overwrite_queue.patch(
+                    channel, discord.Object(member_id), read_messages=True
+                )
+                changes += 1
+
+            for member_id in granted - desired[text_channel_id]:
+                self.overwrite_queue.patch(
+                    channel, discord.Object(member_id), read_messages=None
+                )
+                changes += 1
+
+        return changes
+
+    @commands.Cog.listener()
+    async def on_shard_ready(self, shard_id):
+        guilds = [guild for guild in self.bot.guilds if guild.shard_id == shard_id]
+
+        await self.load_voice_links(guild.id for guild in guilds)
+
+        for guild in guilds:
+            self.reconcile_overwrites(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        await self.load_voice_links([guild.id])
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.voice_links.pop(guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        links = self.voice_links.get(channel.guild.id)
+        if links is None:
+            return
+
+        if channel.id in links or any(
+            channel.id in text_channel_ids for text_channel_ids in links.values()
+        ):
+            self.forget_channel(channel.guild.id, channel.id)
+
+            await self.bot.pool.execute(
+                """
+                DELETE FROM voice_link
+                WHERE text_channel_id = $1 OR voice_channel_id = $1
+                """,
+                channel.id,
+            )
+
     @commands.command()
     @commands.cooldown(3, 8, commands.BucketType.channel)
     @commands.has_permissions(manage_roles=True)
@@ -35,7 +196,7 @@ class Voice(cmd.Cog):
         )
 
         for voice_channel_id, links in grouped_links:
-            voice_channel = get(ctx.guild.channels, id=voice_channel_id)
+            voice_channel = ctx.guild.get_channel(voice_channel_id)
 
             paginator.add_field(
                 name=str(voice_channel),
@@ -66,6 +227,11 @@ class Voice(cmd.Cog):
             voice_channel.id,
         )
 
+        links = await self.get_voice_links(ctx.guild)
+        links[voice_channel.id] = links.get(voice_channel.id, frozenset()) | {
+            text_channel.id
+        }
+
         text_perms = text_channel.permissions_for(ctx.guild.me)
         if not text_perms.view_channel or not text_perms.manage_roles:
             await ctx.reply(
@@ -113,6 +279,8 @@ class Voice(cmd.Cog):
             channel.id,
         )
 
+        self.forget_channel(ctx.guild.id, channel.id)
+
         message = f"{channel.mention} is no longer associated with any voice channels."
         if isinstance(channel, discord.VoiceChannel):
             message = f"Members who connect to {wrap_in_code(channel.name)} will no longer get access to extra channels."
@@ -134,35 +302,23 @@ class Voice(cmd.Cog):
         if before.channel == after.channel:
             return
 
-        before_text_channel_ids = await self.bot.pool.fetch(
-            """
-            SELECT text_channel_id FROM voice_link
-            WHERE voice_channel_id = $1
-            """,
-            before.channel.id if before.channel else 0,
-        )
-        before_text_channels = {
-            get(member.guild.channels, id=channel_id)
-            for (channel_id,) in before_text_channel_ids
-        }
+        links = await self.get_voice_links(member.guild)
 
-        after_text_channel_ids = await self.bot.pool.fetch(
-            """
-            SELECT text_channel_id FROM voice_link
-            WHERE voice_channel_id = $1
-            """,
-            after.channel.id if after.channel else 0,
-        )
-        after_text_channels = {
-            get(member.guild.channels, id=channel_id)
-            for (channel_id,) in after_text_channel_ids
-        }
+        before_channel_id = before.channel.id if before.channel else None
+        after_channel_id = after.channel.id if after.channel else None
+
+        before_text_channel_ids = links.get(before_channel_id, frozenset())
+        after_text_channel_ids = links.get(after_channel_id, frozenset())
 
-        for channel in before_text_channels - after_text_channels:
-            await patch_overwrites(channel, member, read_messages=None)
+        for channel_id in before_text_channel_ids - after_text_channel_ids:
+            channel = member.guild.get_channel(channel_id)
+            if channel:
+                self.overwrite_queue.patch(channel, member, read_messages=None)
 
-        for channel in after_text_channels - before_text_channels:
-            await patch_overwrites(channel, member, read_messages=True)
+        for channel_id in after_text_channel_ids - before_text_channel_ids:
+            channel = member.guild.get_channel(channel_id)
+            if channel:
+                self.overwrite_queue.patch(channel, member, read_messages=True)
 
 
 def setup(bot: commands.Bot):
@@ -0,0 +1,411 @@
+import asyncio
+import collections
+import datetime
+import time
+import traceback
+
+import discord
+
+
+class JobType:
+    def __init__(self, plan_member, *, title: str, action: str, kind: str):
+        self.plan_member = plan_member
+        self.title = title
+        self.action = action
+        self.kind = kind
+
+
+class Job:
+    """A sweep over all members of a guild, stored in the ``job`` table.
+
+    Members are fetched a page at a time. ``plan_member`` of the job type adds
+    the REST calls needed for each member of the page, which are then run
+    through a bounded pool of workers. Calls are grouped by their rate limit
+    bucket, a bucket is drained by a single worker since Discord only allows
+    one request at a time per bucket, and up to ``concurrency`` buckets are
+    drained at once.
+
+    Once a page is done, the last member ID is saved as the cursor so the
+    sweep can resume from there after a restart. Errors are reported and the
+    sweep is retried from the cursor with a backoff, a job that keeps failing
+    is left to be resumed on the next start.
+    """
+
+    page_size = 1000
+    concurrency = 4
+    report_interval = 5
+    max_retries = 5
+    retry_delay = 30
+
+    def __init__(self, manager, record, job_type: JobType):
+        self.manager = manager
+        self.bot = manager.bot
+        self.job_type = job_type
+
+        self.job_id = record["job_id"]
+        self.name = record["job_type"]
+        self.guild_id = record["guild_id"]
+        self.channel_id = record["channel_id"]
+        self.message_id = record["message_id"]
+        self.cursor = record["cursor_member_id"]
+        self.processed = record["processed"]
+        self.done = record["done"]
+        self.failed = record["failed"]
+
+        self.buckets = collections.defaultdict(collections.deque)
+        self.started_at = None
+        self.started_processed = 0
+        self.status = "Waiting"
+        self.cancelled = False
+        self.task = None
+
+    @property
+    def guild(self):
+        return self.bot.get_guild(self.guild_id)
+
+    def add(self, bucket: str, func, *args, **kwargs):
+        """Plans a call to ``func`` that is rate limited in ``bucket``."""
+
+        self.buckets[bucket].append((func, args, kwargs))
+
+    def get_eta(self):
+        """Estimates the time left from the rate members were checked at."""
+
+        if self.status != "Running" or not self.guild or not self.guild.member_count:
+            return None
+
+        checked = self.processed - self.started_processed
+        if checked <= 0:
+            return None
+
+        rate = checked / (time.monotonic() - self.started_at)
+        remaining = max(self.guild.member_count - self.processed, 0)
+
+        return datetime.timedelta(seconds=round(remaining / rate))
+
+    def get_embed(self):
+        checked = str(self.processed)
+        if self.guild and self.guild.member_count:
+            checked += f"/{self.guild.member_count}"
+
+        description = (
+            f"{self.job_type.action}: {self.status}"
+            f"\nMembers checked: {checked}"
+            f"\nChanged: {self.done - self.failed}"
+            f"\nFailed: {self.failed}"
+        )
+
+        eta = self.get_eta()
+        if eta is not None:
+            description += f"\nTime left: {eta}"
+
+        return discord.Embed(title=self.job_type.title, description=description)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    def cancel(self):
+        self.cancelled = True
+        self.task.cancel()
+
+    async def run(self):
+        reporter = asyncio.ensure_future(self.report())
+
+        try:
+            finished = await self.sweep_with_retries()
+        except asyncio.CancelledError:
+            if not self.cancelled:
+                # Interrupted by a shutdown, resumed on the next start
+                raise
+
+            self.status = "Cancelled"
+            finished = True
+        finally:
+            reporter.cancel()
+
+        if finished:
+            await self.delete()
+        await self.edit_message()
+
+    async def sweep_with_retries(self):
+        """Returns whether the sweep finished, rather than giving up."""
+
+        for attempt in range(1, self.max_retries + 2):
+            self.status = "Running"
+            self.started_at = time.monotonic()
+            self.started_processed = self.processed
+            self.buckets.clear()
+
+            try:
+                await self.sweep()
+            except Exception:
+                try:
+                    await self.bot.on_error(f"job #{self.job_id} {self.name}")
+                except Exception:
+                    traceback.print_exc()
+            else:
+                self.status = "Finished"
+                return True
+
+            if attempt > self.max_retries:
+                self.status = "Failed, will resume after a restart"
+                return False
+
+            self.status = f"Retrying after an error ({attempt}/{self.max_retries})"
+            await self.edit_message()
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    async def sweep(self):
+        members = []
+        after = discord.Object(self.cursor) if self.cursor else None
+
+        async for member in self.guild.fetch_members(limit=None, after=after):
+            members.append(member)
+
+            if len(members) >= self.page_size:
+                await self.process(members)
+                members = []
+
+        if members:
+            await self.process(members)
+
+    async def process(self, members):
+        for member in members:
+            self.job_type.plan_member(self, member)
+
+        await self.execute()
+
+        self.cursor = members[-1].id
+        self.processed += len(members)
+        await self.save()
+
+    async def execute(self):
+        buckets = asyncio.Queue()
+        for calls in self.buckets.values():
+            buckets.put_nowait(calls)
+        self.buckets.clear()
+
+        workers = [
+            asyncio.ensure_future(self.worker(buckets))
+            for _ in range(min(self.concurrency, buckets.qsize()))
+        ]
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def worker(self, buckets: asyncio.Queue):
+        while not buckets.empty():
+            calls = buckets.get_nowait()
+
+            while calls:
+                func, args, kwargs = calls.popleft()
+
+                try:
+                    await func(*args, **kwargs)
+                except discord.HTTPException:
+                    self.failed += 1
+
+                self.done += 1
+
+    async def save(self):
+        await self.bot.pool.execute(
+            """
+            UPDATE job
+            SET cursor_member_id = $2, processed = $3, done = $4, failed = $5
+            WHERE job_id = $1
+            """,
+            self.job_id,
+            self.cursor,
+            self.processed,
+            self.done,
+            self.failed,
+        )
+
+    async def delete(self):
+        await self.bot.pool.execute(
+            """
+            DELETE FROM job
+            WHERE job_id = $1
+            """,
+            self.job_id,
+        )
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            await self.edit_message()
+
+    async def edit_message(self):
+        channel = self.bot.get_channel(self.channel_id)
+        if not channel:
+            return
+
+        try:
+            await channel.get_partial_message(self.message_id).edit(
+                embed=self.get_embed()
+            )
+        except discord.HTTPException:
+            pass
+
+
+class JobManager:
+    """Starts, resumes and keeps track of running :class:`Job` instances."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.types = {}
+        self.running = {}
+        self.starting = set()
+
+    def add_type(
+        self, name: str, plan_member, *, title: str, action: str, kind: str = None
+    ):
+        """Registers a job type.
+
+        Only one job of a ``kind`` can run in a guild at a time, the kind
+        defaults to the name of the type.
+        """
+
+        self.types[name] = JobType(
+            plan_member, title=title, action=action, kind=kind or name
+        )
+
+    def remove_type(self, name: str):
+        self.types.pop(name, None)
+
+    async def fetch_guild_jobs(self, guild_id: int, *, kind: str = None):
+        """Returns the jobs of a guild stored in the ``job`` table.
+
+        Jobs that are not running, like those that gave up after too many
+        errors, are returned without being started.
+        """
+
+        records = await self.bot.pool.fetch(
+            """
+            SELECT * FROM job
+            WHERE guild_id = $1
+            ORDER BY job_id
+            """,
+            guild_id,
+        )
+
+        jobs = []
+        for record in records:
+            job = self.running.get(record["job_id"])
+            if job is None:
+                job_type = self.types.get(record["job_type"])
+                if job_type is None:
+                    continue
+
+                job = Job(self, record, job_type)
+                job.status = "Stopped, will resume after a restart"
+
+            if kind in (None, job.job_type.kind):
+                jobs.append(job)
+
+        return jobs
+
+    async def create(self, name: str, ctx):
+        """Creates a job in the guild of ``ctx``, reporting its progress in a reply.
+
+        Returns ``None`` without creating anything if the guild already has a
+        job of the same kind, running or not.
+        """
+
+        job_type = self.types[name]
+        key = (ctx.guild.id, job_type.kind)
+
+        if key in self.starting:
+            return None
+
+        # Claim the kind before awaiting, so a concurrent call sees it
+        self.starting.add(key)
+        try:
+            if await self.fetch_guild_jobs(ctx.guild.id, kind=job_type.kind):
+                return None
+
+            message = await ctx.reply(
+                embed=discord.Embed(
+                    title=job_type.title,
+                    description=f"{job_type.action}: Waiting",
+                )
+            )
+
+            record = await self.bot.pool.fetchrow(
+                """
+                INSERT INTO job (guild_id, channel_id, message_id, job_type)
+                VALUES ($1, $2, $3, $4)
+                RETURNING *
+                """,
+                message.guild.id,
+                message.channel.id,
+                message.id,
+                name,
+            )
+        finally:
+            self.starting.discard(key)
+
+        return self.start(record)
+
+    async def cancel(self, guild_id: int, job_id: int):
+        """Deletes a job of a guild and stops it if it is running.
+
+        Returns whether there was such a job.
+        """
+
+        deleted = await self.bot.pool.fetchval(
+            """
+            DELETE FROM job
+            WHERE job_id = $1 AND guild_id = $2
+            RETURNING job_id
+            """,
+            job_id,
+            guild_id,
+        )
+
+        job = self.running.get(job_id)
+        if job and job.guild_id == guild_id:
+            job.cancel()
+            return True
+
+        return deleted is not None
+
+    def start(self, record):
+        job = Job(self, record, self.types[record["job_type"]])
+        self.running[job.job_id] = job
+
+        job.start().add_done_callback(lambda _: self.running.pop(job.job_id, None))
+
+        return job
+
+    async def resume(self, guild_ids):
+        """Resumes unfinished jobs of ``guild_ids`` that are not running."""
+
+        records = await self.bot.pool.fetch(
+            """
+            SELECT * FROM job
+            WHERE guild_id = ANY($1::BIGINT[])
+            """,
+            list(guild_ids),
+        )
+
+        for record in records:
+            if record["job_id"] in self.running:
+                continue
+            if record["job_type"] not in self.types:
+                continue
+
+            self.start(record)
+
+    async def stop(self):
+        """Interrupts all jobs, leaving them to be resumed on the next start."""
+
+        tasks = [job.task for job in self.running.values()]
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,106 @@
+import asyncio
+import collections
+import traceback
+
+import discord
+
+
+class PendingEdit:
+    __slots__ = ("nick", "add_role_ids")
+
+    def __init__(self):
+        self.nick = None
+        self.add_role_ids = []
+
+
+class MemberEditQueue:
+    """Per guild queues of member edits, drained one request at a time.
+
+    Members are referred to by ID, so edits can be queued straight from
+    gateway payloads. Changes queued for a member that is still waiting are
+    merged into its pending edit, and applied together by the worker. Roles
+    are always added one by one, never by replacing the member's roles with
+    a list that may have changed since it was queued. Requests to edit
+    members are rate limited per guild, so each guild is drained by a single
+    worker.
+
+    Past ``high_water`` queued members, edits that only change a nick are
+    shed, they are cosmetic and redone on the next member update. Past
+    ``max_size`` every new member is shed.
+    """
+
+    high_water = 1000
+    max_size = 10000
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.pending = collections.defaultdict(dict)
+        self.workers = {}
+        self.shed = 0
+
+    def depth(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+    def edit(
+        self,
+        guild_id: int,
+        member_id: int,
+        *,
+        nick: str = None,
+        add_role_ids=(),
+    ):
+        """Queues changes to a member, returns ``False`` if they were shed."""
+
+        queue = self.pending[guild_id]
+
+        edit = queue.get(member_id)
+        if edit is None:
+            if len(queue) >= self.max_size or (
+                len(queue) >= self.high_water and not add_role_ids
+            ):
+                self.shed += 1
+                return False
+
+            edit = queue[member_id] = PendingEdit()
+
+        if nick is not None:
+            edit.nick = nick
+        edit.add_role_ids.extend(add_role_ids)
+
+        if guild_id not in self.workers:
+            self.workers[guild_id] = asyncio.ensure_future(self.drain(guild_id))
+
+        return True
+
+    async def apply(self, guild_id: int, member_id: int, edit: PendingEdit):
+        if edit.nick is not None:
+            # A nick that cannot be changed should not hold back the roles
+            try:
+                await self.bot.http.edit_member(guild_id, member_id, nick=edit.nick)
+            except discord.HTTPException:
+                pass
+
+        for role_id in dict.fromkeys(edit.add_role_ids):
+            await self.bot.http.add_role(guild_id, member_id, role_id)
+
+    async def drain(self, guild_id: int):
+        queue = self.pending[guild_id]
+
+        try:
+            while queue:
+                member_id = next(iter(queue))
+                edit = queue.pop(member_id)
+
+                try:
+                    await self.apply(guild_id, member_id, edit)
+                except discord.HTTPException:
+                    pass
+                except Exception:
+                    try:
+                        await self.bot.on_error(f"member edit {guild_id} {member_id}")
+                    except Exception:
+                        traceback.print_exc()
+        finally:
+            del self.workers[guild_id]
+            if not queue:
+                self.pending.pop(guild_id, None)
@@ -0,0 +1,145 @@
+import asyncio
+import collections
+
+import discord
+
+
+def get_overwrite(channel: discord.abc.GuildChannel, target_id: int, target_type: str):
+    """Returns the overwrite of a role or member by ID.
+
+    Unlike :meth:`discord.abc.GuildChannel.overwrites_for` this does not need
+    the member to be cached.
+    """
+
+    for overwrite in channel._overwrites:
+        if overwrite.id == target_id and overwrite.type == target_type:
+            return discord.PermissionOverwrite.from_pair(
+                discord.Permissions(overwrite.allow),
+                discord.Permissions(overwrite.deny),
+            )
+
+    return discord.PermissionOverwrite()
+
+
+class OverwriteQueue:
+    """Debounced permission overwrite changes, coalesced per channel.
+
+    Changes to a channel wait ``delay`` seconds before being applied, changes
+    to the same target in the meantime are merged so only its final overwrite
+    is written. Overwrites that would end up unchanged are dropped.
+
+    Targets are written by ID through the HTTP client, so members do not need
+    to be cached, a :class:`discord.Object` is taken to be a member.
+    Overwrites of a channel share a rate limit bucket, so each channel is
+    drained by a single worker.
+    """
+
+    delay = 2
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.pending = collections.defaultdict(dict)
+        self.channels = {}
+        self.workers = {}
+        self.flushing = asyncio.Event()
+        self.dropped = 0
+
+    def depth(self):
+        return sum(len(changes) for changes in self.pending.values())
+
+    def patch(
+        self,
+        channel: discord.abc.GuildChannel,
+        target: discord.abc.Snowflake,
+        **permissions,
+    ):
+        """Queues changes to the overwrite of ``target`` in ``channel``.
+
+        Permissions set to ``None`` are removed from the overwrite, the
+        overwrite is deleted once it is empty.
+        """
+
+        target_type = "role" if isinstance(target, discord.Role) else "member"
+        changes = self.pending[channel.id]
+
+        _, queued = changes.get(target.id, (None, {}))
+        changes[target.id] = (target_type, {**queued, **permissions})
+
+        self.channels[channel.id] = channel
+
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.ensure_future(self.drain(channel.id))
+
+    async def flush(self):
+        """Applies all queued changes without waiting for the delay."""
+
+        self.flushing.set()
+
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+        # Workers are cancelled along with every other task when the bot is
+        # stopped by a signal, leaving their changes behind
+        for channel_id in list(self.pending):
+            worker = self.workers.get(channel_id)
+            if worker and not worker.done():
+                continue
+
+            # The finished worker is left in place until then, so changes
+            # queued meanwhile are picked up here instead of by a new worker
+            await self.apply_changes(channel_id, {})
+            self.workers.pop(channel_id, None)
+            self.forget_if_empty(channel_id)
+
+    async def drain(self, channel_id: int):
+        # Overwrites written by this worker, the channel in the cache is only
+        # updated once the gateway tells us about them
+        written = {}
+
+        try:
+            try:
+                await asyncio.wait_for(self.flushing.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+
+            await self.apply_changes(channel_id, written)
+        finally:
+            del self.workers[channel_id]
+            self.forget_if_empty(channel_id)
+
+    async def apply_changes(self, channel_id: int, written: dict):
+        changes = self.pending[channel_id]
+
+        while changes:
+            target_id = next(iter(changes))
+            target_type, permissions = changes.pop(target_id)
+            channel = self.channels[channel_id]
+
+            current = written.get(target_id) or get_overwrite(
+                channel, target_id, target_type
+            )
+            overwrite = discord.PermissionOverwrite(**dict(current))
+            overwrite.update(**permissions)
+
+            if overwrite == current:
+                self.dropped += 1
+                continue
+
+            try:
+                if overwrite.is_empty():
+                    await self.bot.http.delete_channel_permissions(
+                        channel_id, target_id
+                    )
+                else:
+                    allow, deny = overwrite.pair()
+                    await self.bot.http.edit_channel_permissions(
+                        channel_id, target_id, allow.value, deny.value, target_type
+                    )
+            except discord.HTTPException:
+                pass
+            else:
+                written[target_id] = overwrite
+
+    def forget_if_empty(self, channel_id: int):
+        if not self.pending.get(channel_id):
+            self.pending.pop(channel_id, None)
+            self.channels.pop(channel_id, None)
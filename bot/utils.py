@@ -19,6 +19,28 @@ def wrap_in_code(value: str, *, block: Optional[Union[bool, str]] = None):
     return f"```{block}\n" + value + "\n```"
 
 
+def join_lines(lines, *, limit: int):
+    """Joins as many lines as fit in ``limit`` characters, noting the rest."""
+
+    lines = list(lines)
+    joined = []
+    length = 0
+
+    for index, line in enumerate(lines):
+        remaining = len(lines) - index - 1
+        # Leave room to note the lines that do not fit after this one
+        reserved = len(f"\n...and {remaining} more") if remaining else 0
+
+        if length + len(line) + reserved > limit:
+            joined.append(f"...and {len(lines) - index} more")
+            break
+
+        joined.append(line)
+        length += len(line) + 1
+
+    return "\n".join(joined)
+
+
 def get_clean_prefix(ctx: cmd.Context):
     if re.match(f"<@!?{ctx.me.id}>", ctx.prefix):
         return f"@{ctx.me.display_name} "
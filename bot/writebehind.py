@@ -0,0 +1,92 @@
+import asyncio
+import traceback
+
+
+class WriteBehindBuffer:
+    """Coalesces writes per key and flushes them in batches.
+
+    Only the last value put for a key is kept. ``flush_func`` is awaited with
+    a ``{key: value}`` dict of pending writes ``interval`` seconds after the
+    first pending write, or as soon as ``max_size`` keys are pending.
+    Flushes run one at a time, and a batch is only taken once the previous
+    one is done, so a failed batch never lands after a newer one.
+
+    Errors of flushes scheduled in the background are passed to the
+    ``on_error`` coroutine function, and the batch is retried later.
+    """
+
+    def __init__(
+        self,
+        flush_func,
+        *,
+        on_error=None,
+        interval: float = 2,
+        max_size: int = 500,
+    ):
+        self.flush_func = flush_func
+        self.on_error = on_error
+        self.interval = interval
+        self.max_size = max_size
+
+        self.pending = {}
+        self.in_flight = {}
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def items(self):
+        """Writes not committed yet, including the batch being flushed."""
+
+        return {**self.in_flight, **self.pending}.items()
+
+    def put(self, key, value):
+        self.pending[key] = value
+
+        if len(self.pending) >= self.max_size:
+            self.flush_soon()
+        elif self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(
+                self.interval, self.flush_soon
+            )
+
+    def flush_soon(self):
+        asyncio.ensure_future(self.flush_in_background())
+
+    async def flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception:
+            try:
+                if self.on_error is None:
+                    raise
+                await self.on_error()
+            except Exception:
+                traceback.print_exc()
+
+    async def flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        async with self.lock:
+            if not self.pending:
+                return
+
+            self.in_flight, self.pending = self.pending, {}
+
+            try:
+                await self.flush_func(self.in_flight)
+            except BaseException:
+                # Keep the writes for the next flush, unless they were overwritten
+                for key, value in self.in_flight.items():
+                    self.pending.setdefault(key, value)
+
+                if self.timer is None:
+                    self.timer = asyncio.get_event_loop().call_later(
+                        self.interval, self.flush_soon
+                    )
+                raise
+            finally:
+                self.in_flight = {}
@@ -1,5 +1,10 @@
+import asyncio
+import multiprocessing
 import os
+import signal
+import time
 
+import aiohttp
 import dotenv
 
 import bot
@@ -10,7 +15,152 @@ os.environ.setdefault("JISHAKU_HIDE", "true")
 os.environ.setdefault("JISHAKU_NO_UNDERSCORE", "true")
 
 
+async def fetch_recommended_shard_count(token):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v8/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+
+    return data["shards"]
+
+
+def run_cluster(shard_ids, shard_count, ready):
+    app = bot.Bot(shard_ids=shard_ids, shard_count=shard_count)
+
+    async def on_ready():
+        ready.set()
+
+    app.add_listener(on_ready)
+    app.run(os.environ.get("DISCORD_TOKEN"))
+
+
+class Cluster:
+    """A worker process running the bot for a range of shards.
+
+    A cluster that exits within ``stable_after`` seconds of starting is
+    restarted with an exponential backoff, so one crashing in a loop does
+    not keep re-identifying its shards.
+    """
+
+    stable_after = 60
+    restart_delay = 5
+    max_restart_delay = 300
+
+    def __init__(self, index, shard_ids, shard_count):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.started_at = None
+        self.crashes = 0
+        self.restart_at = None
+
+    def start(self, mp_context):
+        ready = mp_context.Event()
+        self.process = mp_context.Process(
+            target=run_cluster,
+            args=(self.shard_ids, self.shard_count, ready),
+            name=f"cluster-{self.index}",
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+
+        # Shards identify one at a time, wait until this cluster is done
+        # identifying before the next one starts so they don't collide
+        ready.wait(timeout=30 + 6 * len(self.shard_ids))
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def should_restart(self):
+        """Returns whether an exited cluster is due to be started again."""
+
+        if self.restart_at is None:
+            if time.monotonic() - self.started_at < self.stable_after:
+                self.crashes += 1
+            else:
+                self.crashes = 0
+
+            delay = 0
+            if self.crashes:
+                delay = min(
+                    self.restart_delay * 2 ** (self.crashes - 1),
+                    self.max_restart_delay,
+                )
+            self.restart_at = time.monotonic() + delay
+
+            print(
+                f"Cluster {self.index} exited with code {self.process.exitcode},"
+                f" restarting in {delay}s"
+            )
+
+        return time.monotonic() >= self.restart_at
+
+
+def stop(signum, frame):
+    raise SystemExit(0)
+
+
+def launch_clusters(cluster_count):
+    token = os.environ.get("DISCORD_TOKEN")
+    shard_count = int(
+        os.environ.get("SHARD_COUNT")
+        or asyncio.run(fetch_recommended_shard_count(token))
+    )
+    cluster_count = min(cluster_count, shard_count)
+
+    clusters = [
+        Cluster(
+            index,
+            list(
+                range(
+                    index * shard_count // cluster_count,
+                    (index + 1) * shard_count // cluster_count,
+                )
+            ),
+            shard_count,
+        )
+        for index in range(cluster_count)
+    ]
+
+    mp_context = multiprocessing.get_context("spawn")
+
+    # SIGTERM has no default action for PID 1 in a container, stop the
+    # clusters so each of them closes the bot cleanly
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        while True:
+            for cluster in clusters:
+                if cluster.is_alive():
+                    continue
+
+                if cluster.process is None or cluster.should_restart():
+                    cluster.start(mp_context)
+
+            time.sleep(5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        processes = [cluster.process for cluster in clusters if cluster.is_alive()]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
 def main():
+    cluster_count = int(os.environ.get("CLUSTER_COUNT", 1))
+    if cluster_count > 1:
+        launch_clusters(cluster_count)
+        return
+
     app = bot.Bot()
     app.run(os.environ.get("DISCORD_TOKEN"))
 
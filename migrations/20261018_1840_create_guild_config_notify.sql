@@ -0,0 +1,12 @@
+CREATE FUNCTION notify_guild_config() RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('guild_config', NEW.guild_id::TEXT);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER guild_config_notify
+AFTER UPDATE ON guild_config
+FOR EACH ROW
+WHEN (OLD IS DISTINCT FROM NEW)
+EXECUTE PROCEDURE notify_guild_config();
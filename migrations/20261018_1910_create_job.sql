@@ -0,0 +1,14 @@
+CREATE TABLE job (
+  job_id SERIAL PRIMARY KEY,
+  guild_id BIGINT NOT NULL REFERENCES guild_config ON DELETE CASCADE,
+  channel_id BIGINT NOT NULL,
+  message_id BIGINT NOT NULL,
+  job_type TEXT NOT NULL,
+  cursor_member_id BIGINT NOT NULL DEFAULT 0,
+  processed INTEGER NOT NULL DEFAULT 0,
+  done INTEGER NOT NULL DEFAULT 0,
+  failed INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX job_guild_id_idx ON job (guild_id);